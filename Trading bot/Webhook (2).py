@@ -1,11 +1,13 @@
 from flask import Flask, request, jsonify
-from datetime import datetime, time as dt_time
-import threading
+from datetime import datetime
 import pytz
-import time
 from alerts import parse_alert_message, alert_manager, send_telegram_alert
 from orders import process_alert
 from login import login_manager
+from trades_db import trade_store
+from risk import risk_engine
+from market_calendar import market_calendar, scheduler
+from reconcile import reconciler
 
 IST = pytz.timezone("Asia/Kolkata")
 app = Flask(__name__)
@@ -48,41 +50,47 @@ def status():
     return jsonify({
         "logged_in": login_manager.is_logged_in(),
         "active_alerts": len(alert_manager.get_recent_alerts()),
+        "risk": risk_engine.snapshot(),
+        "trading_day": market_calendar.is_trading_day(datetime.now(IST).date()),
+        "upcoming_events": scheduler.upcoming(),
         "now": datetime.now(IST).isoformat()
     })
 
-def session_heartbeat():
-    while True:
-        login_manager.keep_alive()
-        time.sleep(600)
-
-def daily_scheduler():
-    login_done = False
-    logout_done = False
-
-    while True:
-        now = datetime.now(IST).time()
-        if now >= dt_time(10, 15) and not login_done:
-            login_manager.login()
-            send_telegram_alert("✅ Auto Login at 10:15 AM")
-            login_done = True
-
-        # 🔒 Logout at 3:30 PM
-        if now >= dt_time(15, 30) and not logout_done:
-            login_manager.logout()
-            send_telegram_alert("🔒 Auto Logout at 3:30 PM")
-            logout_done = True
+@app.route("/reconcile")
+def reconcile():
+    if request.args.get("run"):
+        return jsonify(reconciler.run_once())
+    return jsonify(reconciler.last_report)
+
+@app.route("/trades")
+def trades():
+    since = request.args.get("since")
+    until = request.args.get("until")
+    symbol = request.args.get("symbol")
+    group = request.args.get("by")
+    try:
+        if group:
+            return jsonify({"by": group, "rows": trade_store.pnl_by(group, since, until, symbol)})
+        return jsonify(trade_store.summary(since, until, symbol))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-        if now < dt_time(10, 0):
-            login_done = False
-            logout_done = False
+def scheduled_login():
+    login_manager.login()
+    send_telegram_alert(f"✅ Auto Login at {datetime.now(IST).strftime('%H:%M')}")
 
-        time.sleep(30)
+def scheduled_logout():
+    login_manager.logout()
+    send_telegram_alert(f"🔒 Auto Logout at {datetime.now(IST).strftime('%H:%M')}")
 
 def start_bot():
-    login_manager.login()
-    threading.Thread(target=session_heartbeat, daemon=True).start()
-    threading.Thread(target=daily_scheduler, daemon=True).start()
+    if market_calendar.in_session(datetime.now(IST)):
+        login_manager.login()
+    scheduler.on("login", scheduled_login)
+    scheduler.on("logout", scheduled_logout)
+    scheduler.on("heartbeat", login_manager.keep_alive)
+    scheduler.start()
+    reconciler.start()
 
 start_bot()
 
@@ -39,6 +39,7 @@ def parse_alert_message(msg):
             "entry_price": round_tick(float(alert["entry"])),
             "stoploss_price": round_tick(float(alert["stoploss"])),
             "timestamp": int(alert["time"]),
+            "strategy": alert.get("strategy", "default"),
             "alert_time": datetime.now(IST)
         }
     except:
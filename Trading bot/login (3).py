@@ -4,7 +4,7 @@ from NorenRestApiPy.NorenApi import NorenApi
 import json
 import time
 import pytz
-from datetime import datetime, time as dt_time
+from datetime import datetime
 from alerts import send_telegram_alert
 import pyotp
 
@@ -75,16 +75,15 @@ class LoginManager:
             send_telegram_alert(f"❌ Logout Error: {e}")
 
     def keep_alive(self):
+        # Called by the scheduler only inside the session's heartbeat window
         try:
-            now = datetime.now(IST).time()
-            if dt_time(10, 0) <= now <= dt_time(15, 15):
-                if not self.logged_in:
-                    return  # skip ping if not logged in
-                response = self.api.get_quotes(exchange="NSE", token="26000")
-                if not response or "lp" not in response:
-                    send_telegram_alert("⚠️ Keep-alive: Empty response, re-logging in...")
-                    self.logout()
-                    self.login()
+            if not self.logged_in:
+                return  # skip ping if not logged in
+            response = self.api.get_quotes(exchange="NSE", token="26000")
+            if not response or "lp" not in response:
+                send_telegram_alert("⚠️ Keep-alive: Empty response, re-logging in...")
+                self.logout()
+                self.login()
         except Exception as e:
             send_telegram_alert(f"⚠️ Session ping failed: {e}")
             self.logout()
@@ -0,0 +1,161 @@
+# File: market_calendar.py
+
+import bisect
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+
+IST = pytz.timezone("Asia/Kolkata")
+CALENDAR_FILE = "market_calendar.json"
+
+# Used for any key missing from market_calendar.json
+CALENDAR_DEFAULTS = {
+    "holidays": [],
+    "session": {
+        "login": "10:15",
+        "heartbeat_start": "10:00",
+        "heartbeat_end": "15:15",
+        "entry_cutoff": "14:55",
+        "logout": "15:30"
+    },
+    "heartbeat_interval": 90,
+    # Per strategy: [entered at or after, exit at]; an entry uses the last row it has passed,
+    # and entries before the first row use the first exit
+    "exit_boundaries": {
+        "default": [
+            ["11:15", "12:15"],
+            ["12:15", "13:15"],
+            ["13:15", "14:15"],
+            ["14:15", "14:55"]
+        ]
+    },
+    # Date -> session overrides, e.g. a weekend special or muhurat session
+    "special_sessions": {}
+}
+
+def _parse_hhmm(s):
+    return datetime.strptime(s, "%H:%M").time()
+
+
+class MarketCalendar:
+    def __init__(self, path=CALENDAR_FILE):
+        config = dict(CALENDAR_DEFAULTS)
+        try:
+            with open(path) as f:
+                config.update(json.load(f))
+        except Exception as e:
+            print(f"[market calendar] using defaults: {e}")
+
+        self.holidays = {datetime.strptime(d, "%Y-%m-%d").date() for d in config["holidays"]}
+        self.session = {k: _parse_hhmm(v) for k, v in {**CALENDAR_DEFAULTS["session"], **config["session"]}.items()}
+        self.special_sessions = {
+            datetime.strptime(d, "%Y-%m-%d").date(): {k: _parse_hhmm(v) for k, v in s.items()}
+            for d, s in config["special_sessions"].items()
+        }
+        self.heartbeat_interval = timedelta(seconds=config["heartbeat_interval"])
+        # strategy -> (sorted "from" times, matching exit times) for bisect lookups
+        self.exit_boundaries = {}
+        for strategy, rows in config["exit_boundaries"].items():
+            rows = sorted((_parse_hhmm(a), _parse_hhmm(b)) for a, b in rows)
+            self.exit_boundaries[strategy] = ([a for a, _ in rows], [b for _, b in rows])
+
+    def is_trading_day(self, day):
+        if day in self.special_sessions:
+            return True
+        return day.weekday() < 5 and day not in self.holidays
+
+    def next_trading_day(self, day):
+        day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return day
+
+    def session_times(self, day):
+        return {**self.session, **self.special_sessions.get(day, {})}
+
+    def at(self, day, t):
+        return IST.localize(datetime.combine(day, t))
+
+    def exit_time(self, entry_time, strategy="default"):
+        starts, exits = self.exit_boundaries.get(strategy, self.exit_boundaries["default"])
+        i = max(0, bisect.bisect_right(starts, entry_time.time()) - 1)
+        return entry_time.replace(hour=exits[i].hour, minute=exits[i].minute, second=0, microsecond=0)
+
+    def in_session(self, now):
+        """True on a trading day between that day's login and logout; outside it the bot stays logged out."""
+        if not self.is_trading_day(now.date()):
+            return False
+        s = self.session_times(now.date())
+        return s["login"] <= now.time() < s["logout"]
+
+    def entries_open(self, now):
+        # Same lower bound as in_session, so place_order's lazy login never runs before the session
+        if not self.is_trading_day(now.date()):
+            return False
+        s = self.session_times(now.date())
+        return s["login"] <= now.time() < s["entry_cutoff"]
+
+    def timeline(self, day):
+        """All (when, event) pairs for `day`, sorted; empty on non-trading days."""
+        if not self.is_trading_day(day):
+            return []
+        s = self.session_times(day)
+        events = [
+            (self.at(day, s["login"]), "login"),
+            (self.at(day, s["entry_cutoff"]), "entry_cutoff"),
+            (self.at(day, s["logout"]), "logout")
+        ]
+        when, end = self.at(day, s["heartbeat_start"]), self.at(day, s["heartbeat_end"])
+        while when <= end:
+            events.append((when, "heartbeat"))
+            when += self.heartbeat_interval
+        exit_times = {t for _, exits in self.exit_boundaries.values() for t in exits}
+        events += [(self.at(day, t), "exit_boundary") for t in exit_times]
+        return sorted(events, key=lambda e: e[0])
+
+
+class Scheduler:
+    """Runs registered handlers at each event of the day's timeline, sleeping in between."""
+
+    def __init__(self, calendar):
+        self.calendar = calendar
+        self.handlers = {}
+        self.today = []
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def _fire(self, event):
+        for handler in self.handlers.get(event, []):
+            try:
+                handler()
+            except Exception as e:
+                print(f"[scheduler {event} error] {e}")
+
+    def run(self):
+        started = datetime.now(IST)
+        while True:
+            day = datetime.now(IST).date()
+            self.today = self.calendar.timeline(day)
+            for when, event in self.today:
+                if when < started:
+                    continue  # already passed when the bot started
+                # Events that fell due while an earlier handler ran are fired late, not dropped
+                time.sleep(max(0.0, (when - datetime.now(IST)).total_seconds()))
+                self._fire(event)
+            next_day = self.calendar.next_trading_day(day)
+            time.sleep(max(0.0, (self.calendar.at(next_day, datetime.min.time()) - datetime.now(IST)).total_seconds()))
+
+    def upcoming(self):
+        now = datetime.now(IST)
+        return [{"time": when.isoformat(), "event": event}
+                for when, event in self.today if when > now and event != "heartbeat"]
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+
+market_calendar = MarketCalendar()
+scheduler = Scheduler(market_calendar)
@@ -1,5 +1,5 @@
 import logging
-from datetime import datetime, timedelta, time as dt_time
+from datetime import datetime, timedelta
 import pytz
 import time
 import threading
@@ -9,6 +9,10 @@ import re
 from oauth2client.service_account import ServiceAccountCredentials
 from alerts import round_tick, alert_manager, send_telegram_alert
 from login import login_manager
+from trailing import TrailingEngine, quote_cache
+from trades_db import trade_store
+from risk import risk_engine
+from market_calendar import market_calendar, scheduler
 
 logger = logging.getLogger(__name__)
 IST = pytz.timezone("Asia/Kolkata")
@@ -23,20 +27,12 @@ sheet = gc.open("Trade Alerts DB").sheet1
 active_positions = {}
 pending_entries = {}
 closed_trades = []
+exit_wakeup = threading.Event()
 
-# Auto-login at startup
-if not login_manager.is_logged_in():
+# Auto-login at startup, unless restarted outside the trading session
+if not login_manager.is_logged_in() and market_calendar.in_session(datetime.now(IST)):
     login_manager.login()
 
-# --- Session Heartbeat ---
-def session_heartbeat():
-    while True:
-        try:
-            login_manager.keep_alive()
-        except Exception as e:
-            print(f"Session heartbeat error: {e}")
-        time.sleep(90)
-
 # Util to get column index by name (updated for date column)
 COLS = {
     "date": 1,
@@ -97,35 +93,75 @@ class SmartSymbolMapper:
 
 symbol_mapper = SmartSymbolMapper()
 
+def row_entry_time(row):
+    ts_str = row.get("entry_timestamp")
+    if ts_str:
+        today = datetime.now(IST).date()
+        return IST.localize(datetime.combine(today, datetime.strptime(ts_str, "%H:%M").time()))
+    return datetime.now(IST)
+
+def restore_position(row):
+    entry_id = str(row.get("entry_order_id", ""))
+    pid = f"{row['symbol']}_{row['action']}_{entry_id}"
+    entry_time = row_entry_time(row)
+    # The sheet keeps the alert's SL; trades.db has the live (possibly trailed) level
+    stored = trade_store.trade(entry_id) or {}
+    active_positions[pid] = {
+        "symbol": row["symbol"],
+        "action": row["action"],
+        "entry_price": float(row["entry_price"]),
+        "stoploss_price": stored.get("stoploss_price") or float(row["stoploss_price"]),
+        "initial_stoploss": stored.get("initial_stoploss") or float(row["stoploss_price"]),
+        "entry_order_id": entry_id,
+        "sl_order_id": str(row.get("sl_order_id", "")),
+        "entry_time": entry_time,
+        "strategy": stored.get("strategy") or "default",
+        "exit_time": calculate_exit_time(entry_time, stored.get("strategy") or "default")
+    }
+    risk_engine.on_fill(entry_id, row["symbol"], row["action"], float(row["entry_price"]))
+    return pid
+
+def restore_pending(row):
+    entry_id = str(row.get("entry_order_id", ""))
+    pid = f"{row['symbol']}_{row['action']}_{entry_id}"
+    stored = trade_store.trade(entry_id) or {}
+    pending_entries[pid] = {
+        "symbol": row["symbol"],
+        "action": row["action"],
+        "entry_price": float(row["entry_price"]),
+        "stoploss_price": float(row["stoploss_price"]),
+        "entry_order_id": entry_id,
+        "strategy": stored.get("strategy") or "default",
+        "alert_time": row_entry_time(row)
+    }
+    risk_engine.on_entry(entry_id, row["symbol"], row["action"], float(row["entry_price"]))
+    return pid
+
 def restore_state_from_sheet():
     records = sheet.get_all_records()
+    today = datetime.now(IST).date().strftime("%Y-%m-%d")
     for row in records:
         entry_id = str(row.get("entry_order_id", ""))
         sl_id = str(row.get("sl_order_id", ""))
         status = row.get("status")
-        if status == "exited":
+        if status == "exited" or row.get("closed_flag") == "Yes":
             continue
+        if str(row.get("date")) != today:
+            continue  # intraday orders from earlier days are gone at the broker
         if entry_id and sl_id and status == "sl_placed":
-            pid = f"{row['symbol']}_{row['action']}_{entry_id}"
-            ts_str = row.get("entry_timestamp")
-            if ts_str:
-                today = datetime.now(IST).date()
-                entry_time = datetime.strptime(ts_str, "%H:%M").replace(
-                    year=today.year, month=today.month, day=today.day, tzinfo=IST
-                )
-            else:
-                entry_time = datetime.now(IST)
+            restore_position(row)
+        elif entry_id and status == "pending":
+            restore_pending(row)
 
-            active_positions[pid] = {
-                "symbol": row["symbol"],
-                "action": row["action"],
-                "entry_price": float(row["entry_price"]),
-                "stoploss_price": float(row["stoploss_price"]),
-                "entry_order_id": entry_id,
-                "sl_order_id": sl_id,
-                "entry_time": entry_time,
-                "exit_time": calculate_exit_time(entry_time)
-            }
+def fetch_row(entry_order_id):
+    # Fresh read of a single row, keyed like get_all_records()
+    try:
+        cell = sheet.find(str(entry_order_id))
+        values = sheet.row_values(cell.row)
+        return {name: values[col - 1] if col <= len(values) else "" for name, col in COLS.items()}
+    except Exception as e:
+        print(f"[fetch_row error] {e}")
+        return None
 
 def update_status_in_sheet(entry_order_id, status, closed_flag):
     try:
@@ -181,6 +217,8 @@ def _parse_time(exchtime_str):
 
 def fetch_order_book():
     if not login_manager.is_logged_in():
+        if not market_calendar.in_session(datetime.now(IST)):
+            return []  # don't log back in after logout or on holidays
         login_manager.login()
     try:
         api = login_manager.get_api()
@@ -202,6 +240,15 @@ def get_filled_price(order_id):
         pass
     return 0
 
+def wait_for_fill_price(order_id, attempts=5, delay=1):
+    # MKT fills show up in the book a moment after placement; avgprc is 0 until then
+    for _ in range(attempts):
+        price = get_filled_price(order_id)
+        if price:
+            return price
+        time.sleep(delay)
+    return 0
+
 def place_order(symbol, action, price):
     # Clean symbol before placing order
     clean_symbol = symbol_mapper.clean_and_convert(symbol)
@@ -329,39 +376,50 @@ def place_stoploss(symbol, action, trigger, entry_order_id):
         send_telegram_alert(f"❌ SL Placement Failed: {ret}")
         return None
 
-def calculate_exit_time(entry_time):
-    t = entry_time.time()
-    if dt_time(11, 15) <= t < dt_time(12, 15):
-        return entry_time.replace(hour=12, minute=15, second=0, microsecond=0)
-    elif dt_time(12, 15) <= t < dt_time(13, 15):
-        return entry_time.replace(hour=13, minute=15, second=0, microsecond=0)
-    elif dt_time(13, 15) <= t < dt_time(14, 15):
-        return entry_time.replace(hour=14, minute=15, second=0, microsecond=0)
-    elif dt_time(14, 15) <= t:
-        return entry_time.replace(hour=14, minute=55, second=0, microsecond=0)
-    return None
+def calculate_exit_time(entry_time, strategy="default"):
+    # Boundaries come from market_calendar.json, per strategy
+    return market_calendar.exit_time(entry_time, strategy)
+
+def realized_pnl(pos, exit_price):
+    if not exit_price:
+        return 0.0
+    if pos["action"] == "buy":
+        return exit_price - pos["entry_price"]
+    return pos["entry_price"] - exit_price
 
 def process_alert(alert):
     symbol = symbol_mapper.clean_and_convert(alert["symbol"])
     action = alert["action"]
     entry = alert["entry_price"]
     sl = alert["stoploss_price"]
+    strategy = alert.get("strategy", "default")
     pid = f"{symbol}_{action}_{int(datetime.now().timestamp())}"
+    if not market_calendar.entries_open(datetime.now(IST)):
+        send_telegram_alert(f"⏰ Entry window closed: {symbol} ({action.upper()}) ignored")
+        return {"status": "rejected", "reason": "outside entry window"}
+    reservation, reason = risk_engine.check(symbol, action, entry)
+    if not reservation:
+        send_telegram_alert(f"🛑 Risk Rejected: {symbol} ({action.upper()}) @ ₹{entry} | {reason}")
+        return {"status": "rejected", "reason": reason}
     oid = place_order(symbol, action, entry)
     if oid:
         row = [symbol, action, entry, sl, oid,
                datetime.now(IST).strftime("%H:%M"), "", "", "", "", "", "pending", ""]
         append_to_sheet(row)
+        trade_store.record_entry(oid, symbol, action, entry, sl, strategy)
+        risk_engine.on_entry(oid, symbol, action, entry, reservation)
         pending_entries[pid] = {
             "symbol": symbol,
             "action": action,
             "entry_price": entry,
             "stoploss_price": sl,
             "entry_order_id": oid,
+            "strategy": strategy,
             "alert_time": datetime.now(IST)
         }
         return {"status": "success", "position_id": pid}
     else:
+        risk_engine.release(reservation)
         alert_manager.save_alert(alert)
         return {"status": "failed", "reason": "order placement failed"}
 
@@ -375,17 +433,24 @@ def process_complete(order):
         order_time = _parse_time(order.get("exch_tm"))
         sl_price = fetch_sl_price(order_id)
         sl_id = place_stoploss(symbol, action, sl_price, order_id)
+        pending = next((p for p in pending_entries.values() if p["entry_order_id"] == order_id), {})
+        strategy = pending.get("strategy") or (trade_store.trade(order_id) or {}).get("strategy") or "default"
         if sl_id:
             active_positions[pid] = {
                 "symbol": symbol,
                 "action": action,
                 "entry_price": entry_price,
                 "stoploss_price": sl_price,
+                "initial_stoploss": sl_price,
                 "entry_order_id": order_id,
                 "sl_order_id": sl_id,
                 "entry_time": order_time,
-                "exit_time": calculate_exit_time(order_time)
+                "strategy": strategy,
+                "exit_time": calculate_exit_time(order_time, strategy)
             }
+            trade_store.record_fill(order_id, entry_price, order_time, sl_id)
+            risk_engine.on_fill(order_id, symbol, action, entry_price)
+            quote_cache.watch(symbol)
             print(f"[monitor] SL placed for {pid}: {sl_id}")
 
 # --- Monitor Thread for Pending Orders ---
@@ -438,6 +503,8 @@ def monitor_pending():
                         if response and response.get("stat") == "Ok":
                             send_telegram_alert(f"🚫 Stale Entry Auto-Cancelled: {symbol} | ID: {entry_id} | Deadline: {deadline.strftime('%H:%M')}")
                             update_status_in_sheet(entry_id, "cancelled", "Yes")
+                            trade_store.record_cancel(entry_id)
+                            risk_engine.on_close(entry_id)
                             print(f"[cancel] Stale order {entry_id} cancelled at {now.strftime('%H:%M')}")
                         else:
                             print(f"[error] Could not cancel {entry_id}: {response}")
@@ -453,26 +520,45 @@ def monitor_pending():
 
 
 # --- Monitor Active Positions for Market Exit ---
+def close_on_sl(pid, sl_price):
+    pos = active_positions.pop(pid, None)
+    if not pos:
+        return None
+    update_status_in_sheet(pos["entry_order_id"], "exited", "Yes")
+    trade_store.record_exit(pos["entry_order_id"], sl_price, pos["sl_order_id"], "sl")
+    risk_engine.on_close(pos["entry_order_id"], realized_pnl(pos, sl_price))
+    closed_trades.append(pos)
+    return pos
+
+def seconds_until_next_exit(now, cap=60):
+    exits = [pos["exit_time"] for pos in active_positions.values()]
+    if not exits:
+        return cap
+    return min(cap, max(0.0, (min(exits) - now).total_seconds()))
+
 def monitor_active_positions():
     while True:
         now = datetime.now(IST)
         for pid in list(active_positions.keys()):
-            pos = active_positions[pid]
+            pos = active_positions.get(pid)
+            if not pos:
+                continue  # closed by the reconciler meanwhile
 
             if now >= pos["exit_time"]:
                 order_statuses = fetch_order_book()
                 sl_filled = False
+                sl_price = 0
 
                 for order in order_statuses:
                     if order.get("norenordno") == pos["sl_order_id"]:
                         if order.get("status") == "COMPLETE":
                             sl_filled = True
+                            sl_price = float(order.get("avgprc", 0))
                             break
 
                 if sl_filled:
                     print(f"[info] SL already filled for {pid}, skipping market exit.")
-                    active_positions.pop(pid, None)
-                    update_status_in_sheet(pos["entry_order_id"], "exited", "Yes")
+                    close_on_sl(pid, sl_price)
                     continue
 
                 api = login_manager.get_api()
@@ -483,15 +569,25 @@ def monitor_active_positions():
                     print(f"[warn] Could not cancel SL for {pid}: {e}")
                 reverse = "sell" if pos["action"] == "buy" else "buy"
                 price, mkt_order_id = place_market_order(pos["symbol"], reverse)
+                if not price and mkt_order_id:
+                    price = wait_for_fill_price(mkt_order_id)
+                    if not price:
+                        send_telegram_alert(f"⚠️ Exit price unknown for {pos['symbol']} | Order ID: {mkt_order_id}")
                 update_exit_in_sheet(pos["entry_order_id"], price, mkt_order_id)
+                trade_store.record_exit(pos["entry_order_id"], price, mkt_order_id, "time")
+                risk_engine.on_close(pos["entry_order_id"], realized_pnl(pos, price))
                 closed_trades.append(pos)
                 active_positions.pop(pid, None)
                 send_telegram_alert(f"💡 Exit: {pos['symbol']} @ MKT | Entry: ₹{pos['entry_price']} | SL: ₹{pos['stoploss_price']}")
-        time.sleep(10)
+        # Sleep until the nearest exit; the scheduler also wakes us on every exit boundary
+        exit_wakeup.wait(timeout=seconds_until_next_exit(datetime.now(IST)))
+        exit_wakeup.clear()
 
 # --- Startup ---
 restore_state_from_sheet()
-threading.Thread(target=session_heartbeat, daemon=True).start()
+trailing_engine = TrailingEngine(active_positions, symbol_mapper, quote_cache)
+trailing_engine.start()
+scheduler.on("exit_boundary", exit_wakeup.set)
 threading.Thread(target=monitor_pending, daemon=True).start()
 threading.Thread(target=monitor_active_positions, daemon=True).start()
 logger.info("✅ orders.py initialized and monitoring threads started.")
@@ -0,0 +1,229 @@
+# File: reconcile.py
+
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+from alerts import send_telegram_alert
+from trades_db import trade_store
+from risk import risk_engine
+from market_calendar import market_calendar
+import orders
+
+IST = pytz.timezone("Asia/Kolkata")
+
+WORKING = {"OPEN", "TRIGGER PENDING", "TRIGGER_PENDING", "PENDING"}
+DEAD = {"CANCELED", "CANCELLED", "REJECTED"}
+
+# Drift types that are repaired automatically; everything else is only reported
+SAFE_REPAIRS = {
+    "stale_pending_row",   # sheet/local pending entry is cancelled or unknown at broker -> mark cancelled
+    "untracked_pending",   # working entry at broker that local state does not know -> track it
+    "untracked_fill",      # entry filled but no active position -> place SL via process_complete
+    "untracked_position",  # sheet says sl_placed, SL still working, no local position -> restore from a fresh row
+    "sl_filled"            # SL completed at broker but position still active -> close it
+}
+
+
+class Reconciler:
+    """
+    Joins broker orders, in-memory state and the sheet by order ID and
+    classifies drift between them.
+
+    Each source is indexed into a dict once per cycle, so a cycle is a single
+    pass over each source with O(1) lookups. The sheet is the slow source
+    (network + API quota), so its rows and index are refreshed less often
+    than the order book.
+    """
+
+    def __init__(self, interval=5, sheet_refresh=30, repair_backoff=60, pending_grace=60):
+        self.interval = interval
+        self.sheet_refresh = sheet_refresh
+        self.repair_backoff = repair_backoff
+        self.pending_grace = timedelta(seconds=pending_grace)
+        self.lock = threading.Lock()  # one cycle at a time, whether from the loop or /reconcile
+        self.repair_attempts = {}  # (type, order_id) -> monotonic time of last attempt
+        self.sheet_index = {}   # entry_order_id -> row, all rows
+        self.open_rows = []     # today's rows not yet closed
+        self.sheet_sl_ids = set()
+        self.sheet_loaded_at = 0
+        self.alerted = set()
+        self.last_report = {}
+
+    def refresh_sheet(self, force=False):
+        if not force and time.monotonic() - self.sheet_loaded_at < self.sheet_refresh:
+            return
+        records = orders.sheet.get_all_records()
+        today = datetime.now(IST).date().strftime("%Y-%m-%d")
+        self.sheet_index = {str(r.get("entry_order_id", "")): r for r in records if r.get("entry_order_id")}
+        self.sheet_sl_ids = {str(r.get("sl_order_id")) for r in records if r.get("sl_order_id")}
+        self.open_rows = [r for r in records
+                          if r.get("closed_flag") != "Yes" and r.get("entry_order_id") and str(r.get("date")) == today]
+        self.sheet_loaded_at = time.monotonic()
+
+    def _is_young(self, eid, row, pending_by_entry, now):
+        # Entries this young may not have reached the book or the sheet cache yet
+        pid = pending_by_entry.get(eid)
+        if pid and pid in orders.pending_entries:
+            return now - orders.pending_entries[pid]["alert_time"] < self.pending_grace
+        # entry_timestamp is HH:MM, so allow one extra minute for the truncation
+        return now - orders.row_entry_time(row) < self.pending_grace + timedelta(minutes=1)
+
+    def classify(self, book):
+        """Return a list of drift dicts for the current broker book and local/sheet state."""
+        broker = {o.get("norenordno"): o for o in book}
+        active_by_entry = {p["entry_order_id"]: pid for pid, p in list(orders.active_positions.items())}
+        active_by_sl = {p["sl_order_id"]: pid for pid, p in list(orders.active_positions.items())}
+        pending_by_entry = {p["entry_order_id"]: pid for pid, p in list(orders.pending_entries.items())}
+        drift, seen = [], set()
+        now = datetime.now(IST)
+
+        def add(kind, order_id, symbol, detail, **extra):
+            if (kind, order_id) in seen:
+                return
+            seen.add((kind, order_id))
+            drift.append({"type": kind, "order_id": order_id, "symbol": symbol, "detail": detail, **extra})
+
+        # Sheet rows that are still open today
+        for row in self.open_rows:
+            eid = str(row["entry_order_id"])
+            status = row.get("status")
+            order = broker.get(eid)
+            broker_status = order.get("status") if order else None
+            if status == "pending":
+                if self._is_young(eid, row, pending_by_entry, now):
+                    continue
+                if not order or broker_status in DEAD:
+                    add("stale_pending_row", eid, row.get("symbol"), f"broker status {broker_status}")
+                elif broker_status == "COMPLETE" and eid not in active_by_entry:
+                    add("untracked_fill", eid, row.get("symbol"), "entry filled without SL", order=order)
+                elif broker_status in WORKING and eid not in pending_by_entry:
+                    add("untracked_pending", eid, row.get("symbol"), "working entry not tracked locally", row=row)
+            elif status == "sl_placed" and eid not in active_by_entry:
+                sl_order = broker.get(str(row.get("sl_order_id")))
+                if sl_order and sl_order.get("status") in WORKING:
+                    add("untracked_position", eid, row.get("symbol"), "sheet has SL but no local position")
+
+        # Local pending entries
+        for pid, p in list(orders.pending_entries.items()):
+            eid = p["entry_order_id"]
+            order = broker.get(eid)
+            broker_status = order.get("status") if order else None
+            if broker_status in DEAD or (not order and now - p["alert_time"] >= self.pending_grace):
+                add("stale_pending_row", eid, p["symbol"], f"broker status {broker_status}")
+            elif broker_status == "COMPLETE" and eid not in active_by_entry:
+                add("untracked_fill", eid, p["symbol"], "entry filled without SL", order=order)
+
+        # Local active positions
+        for pid, pos in list(orders.active_positions.items()):
+            eid, sl_id = pos["entry_order_id"], pos["sl_order_id"]
+            row = self.sheet_index.get(eid)
+            if row and (row.get("status") in ("exited", "cancelled") or row.get("closed_flag") == "Yes"):
+                add("sheet_closed_local_open", eid, pos["symbol"], f"sheet status {row.get('status')}")
+            sl_order = broker.get(sl_id)
+            sl_status = sl_order.get("status") if sl_order else None
+            if sl_status == "COMPLETE":
+                add("sl_filled", eid, pos["symbol"], "SL filled before exit time", pid=pid,
+                    price=float(sl_order.get("avgprc", 0)))
+            elif sl_status is None or sl_status in DEAD:
+                add("missing_sl", eid, pos["symbol"], f"SL {sl_id} status {sl_status}")
+
+        # Working broker orders nobody knows about
+        for oid, order in broker.items():
+            if order.get("status") not in WORKING:
+                continue
+            if oid in self.sheet_index or oid in self.sheet_sl_ids or oid in active_by_sl or oid in pending_by_entry:
+                continue
+            add("orphan_broker_order", oid, order.get("tsym"), f"{order.get('trantype')} {order.get('prctyp')} not tracked")
+
+        return drift
+
+    def repair(self, item):
+        kind, eid = item["type"], item["order_id"]
+        if kind == "stale_pending_row":
+            orders.update_status_in_sheet(eid, "cancelled", "Yes")
+            trade_store.record_cancel(eid, "reconciled")
+            risk_engine.on_close(eid)
+            for pid in [pid for pid, p in orders.pending_entries.items() if p["entry_order_id"] == eid]:
+                orders.pending_entries.pop(pid, None)
+        elif kind == "untracked_pending":
+            orders.restore_pending(item["row"])
+        elif kind == "untracked_fill":
+            orders.process_complete(item["order"])
+            if not any(p["entry_order_id"] == eid for p in list(orders.active_positions.values())):
+                return False  # SL placement failed; keep it pending and retry after the backoff
+            for pid in [pid for pid, p in orders.pending_entries.items() if p["entry_order_id"] == eid]:
+                orders.pending_entries.pop(pid, None)
+        elif kind == "untracked_position":
+            # Never restore from the cached rows: the trade may have exited since they were read
+            row = orders.fetch_row(eid)
+            if not row or row.get("status") != "sl_placed" or row.get("closed_flag") == "Yes":
+                return False
+            if trade_store.status(eid) == "exited":
+                return False
+            if any(p["entry_order_id"] == eid for p in list(orders.active_positions.values())):
+                return False
+            orders.restore_position(row)
+        elif kind == "sl_filled":
+            orders.close_on_sl(item["pid"], item["price"])
+        else:
+            return False
+        return True
+
+    def run_once(self):
+        with self.lock:
+            return self._run_once()
+
+    def _run_once(self):
+        if not market_calendar.in_session(datetime.now(IST)):
+            return self.last_report  # no book, sheet or login traffic outside the session
+        # Sheet first: every row in the snapshot was placed before the book is fetched
+        self.refresh_sheet()
+        book = orders.fetch_order_book()
+        if not book and (self.open_rows or orders.active_positions):
+            # An empty book while we hold state means the fetch failed, not that orders vanished
+            return self.last_report
+
+        drift = self.classify(book)
+        repaired = 0
+        for item in drift:
+            key = (item["type"], item["order_id"])
+            item["repaired"] = False
+            last_attempt = self.repair_attempts.get(key)
+            if item["type"] in SAFE_REPAIRS and (last_attempt is None or time.monotonic() - last_attempt >= self.repair_backoff):
+                # A failed repair (e.g. SL placement rejected) is retried only after the backoff
+                self.repair_attempts[key] = time.monotonic()
+                try:
+                    item["repaired"] = self.repair(item)
+                    repaired += item["repaired"]
+                except Exception as e:
+                    print(f"[reconcile repair error] {item['type']} {item['order_id']}: {e}")
+            if key not in self.alerted:
+                self.alerted.add(key)
+                action = "🛠 Repaired" if item["repaired"] else "⚠️ Drift"
+                send_telegram_alert(f"{action}: {item['type']} | {item['symbol']} | ID: {item['order_id']} | {item['detail']}")
+        if repaired:
+            self.refresh_sheet(force=True)
+
+        self.last_report = {
+            "time": datetime.now(IST).isoformat(),
+            "broker_orders": len(book),
+            "open_sheet_rows": len(self.open_rows),
+            "drift": [{k: v for k, v in d.items() if k not in ("order", "row")} for d in drift],
+            "repaired": repaired
+        }
+        return self.last_report
+
+    def loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"[reconcile error] {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        threading.Thread(target=self.loop, daemon=True).start()
+
+
+reconciler = Reconciler()
@@ -0,0 +1,173 @@
+# File: risk.py
+
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime
+import pytz
+from trades_db import trade_store
+
+IST = pytz.timezone("Asia/Kolkata")
+
+# Defaults used when config.json has no "risk" section. 0 disables a limit.
+RISK_DEFAULTS = {
+    "enabled": True,
+    "max_open_positions": 10,
+    "max_positions_per_symbol": 1,
+    "max_total_notional": 0,
+    "max_symbol_notional": 0,
+    "daily_loss_limit": 0,       # stop taking entries once realized P&L <= -limit
+    "allow_opposite_side": False
+}
+
+def load_risk_config():
+    config = dict(RISK_DEFAULTS)
+    try:
+        with open("config.json") as f:
+            config.update(json.load(f).get("risk", {}))
+    except Exception as e:
+        print(f"[risk config] using defaults: {e}")
+    return config
+
+
+class RiskEngine:
+    """
+    Pre-trade checks against incrementally maintained exposure aggregates.
+
+    Every order that can hold exposure (pending entry or open position) is
+    tracked by entry order ID, and the per-symbol / per-side / total counters
+    are adjusted on each lifecycle event, so `check` never scans positions or
+    the sheet. A passing `check` reserves the exposure under the same lock,
+    so concurrent alerts cannot both squeeze under a limit while their
+    orders are in flight; the reservation is re-keyed to the order ID by
+    `on_entry` or dropped by `release`.
+    """
+
+    def __init__(self):
+        self.config = load_risk_config()
+        self.lock = threading.Lock()
+        self.orders = {}  # entry_order_id -> {"symbol", "side", "notional", "state"}
+        self.count_total = 0
+        self.notional_total = 0.0
+        self.count_by_symbol = defaultdict(int)
+        self.notional_by_symbol = defaultdict(float)
+        self.count_by_side = defaultdict(int)  # (symbol, action) -> count
+        self.pnl_date = datetime.now(IST).date()
+        self.realized_pnl = self._stored_pnl(self.pnl_date)
+        self.rejections = 0
+        self.next_reservation = 0
+
+    def _stored_pnl(self, day):
+        # Seed from the warehouse so a restart does not re-arm the daily loss limit
+        try:
+            return trade_store.summary(since=day.strftime("%Y-%m-%d"))["pnl"] or 0.0
+        except Exception as e:
+            print(f"[risk] could not load today's P&L: {e}")
+            return 0.0
+
+    def _roll_day(self):
+        today = datetime.now(IST).date()
+        if today != self.pnl_date:
+            self.pnl_date = today
+            self.realized_pnl = 0.0
+
+    def _add(self, symbol, side, notional, sign):
+        self.count_total += sign
+        self.notional_total += sign * notional
+        self.count_by_symbol[symbol] += sign
+        self.notional_by_symbol[symbol] += sign * notional
+        self.count_by_side[(symbol, side)] += sign
+
+    def _remove(self, key):
+        order = self.orders.pop(key, None)
+        if not order:
+            return None
+        self._add(order["symbol"], order["side"], order["notional"], -1)
+        if self.count_by_symbol[order["symbol"]] == 0:
+            self.count_by_symbol.pop(order["symbol"], None)
+            self.notional_by_symbol.pop(order["symbol"], None)
+        if self.count_by_side[(order["symbol"], order["side"])] == 0:
+            self.count_by_side.pop((order["symbol"], order["side"]), None)
+        return order
+
+    def check(self, symbol, action, price):
+        """Return (reservation, reason) for a new entry of one share at `price`; reservation is None if rejected."""
+        cfg = self.config
+        opposite = "sell" if action == "buy" else "buy"
+        with self.lock:
+            self._roll_day()
+            if cfg["daily_loss_limit"] and self.realized_pnl <= -cfg["daily_loss_limit"]:
+                reason = f"daily loss limit hit (realized ₹{round(self.realized_pnl, 2)})"
+            elif cfg["max_open_positions"] and self.count_total >= cfg["max_open_positions"]:
+                reason = f"max open positions ({cfg['max_open_positions']}) reached"
+            elif cfg["max_positions_per_symbol"] and self.count_by_symbol[symbol] >= cfg["max_positions_per_symbol"]:
+                reason = f"max positions for {symbol} ({cfg['max_positions_per_symbol']}) reached"
+            elif not cfg["allow_opposite_side"] and self.count_by_side[(symbol, opposite)] > 0:
+                reason = f"opposite {opposite.upper()} position open in {symbol}"
+            elif cfg["max_total_notional"] and self.notional_total + price > cfg["max_total_notional"]:
+                reason = f"total notional limit ₹{cfg['max_total_notional']} exceeded"
+            elif cfg["max_symbol_notional"] and self.notional_by_symbol[symbol] + price > cfg["max_symbol_notional"]:
+                reason = f"{symbol} notional limit ₹{cfg['max_symbol_notional']} exceeded"
+            else:
+                reason = None
+            if reason and cfg["enabled"]:
+                self.rejections += 1
+                return None, reason
+            self.next_reservation += 1
+            reservation = f"reserved-{self.next_reservation}"
+            self.orders[reservation] = {"symbol": symbol, "side": action, "notional": price, "state": "pending"}
+            self._add(symbol, action, price, 1)
+            return reservation, ""
+
+    def release(self, reservation):
+        with self.lock:
+            self._remove(reservation)
+
+    # --- Lifecycle events ---
+    def on_entry(self, entry_order_id, symbol, action, price, reservation=None):
+        with self.lock:
+            if entry_order_id in self.orders:
+                self._remove(reservation)
+                return
+            if reservation in self.orders:
+                self.orders[entry_order_id] = self.orders.pop(reservation)
+                return
+            self.orders[entry_order_id] = {"symbol": symbol, "side": action, "notional": price, "state": "pending"}
+            self._add(symbol, action, price, 1)
+
+    def on_fill(self, entry_order_id, symbol, action, fill_price):
+        with self.lock:
+            order = self.orders.get(entry_order_id)
+            if order:
+                # Re-price the reservation at the actual fill
+                self.notional_total += fill_price - order["notional"]
+                self.notional_by_symbol[order["symbol"]] += fill_price - order["notional"]
+                order["notional"] = fill_price
+                order["state"] = "open"
+                return
+            self.orders[entry_order_id] = {"symbol": symbol, "side": action, "notional": fill_price, "state": "open"}
+            self._add(symbol, action, fill_price, 1)
+
+    def on_close(self, entry_order_id, pnl=0.0):
+        with self.lock:
+            if not self._remove(entry_order_id):
+                return
+            self._roll_day()
+            self.realized_pnl += pnl
+
+    def snapshot(self):
+        with self.lock:
+            self._roll_day()
+            return {
+                "open_orders": self.count_total,
+                "pending": sum(1 for o in self.orders.values() if o["state"] == "pending"),
+                "total_notional": round(self.notional_total, 2),
+                "by_symbol": {s: {"count": c, "notional": round(self.notional_by_symbol[s], 2)}
+                              for s, c in self.count_by_symbol.items()},
+                "realized_pnl": round(self.realized_pnl, 2),
+                "rejections": self.rejections,
+                "limits": self.config
+            }
+
+
+risk_engine = RiskEngine()
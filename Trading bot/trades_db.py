@@ -0,0 +1,256 @@
+# File: trades_db.py
+
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import datetime
+import pytz
+
+IST = pytz.timezone("Asia/Kolkata")
+TRADES_DB_FILE = "trades.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trades (
+    entry_order_id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    symbol TEXT NOT NULL,
+    action TEXT NOT NULL,
+    entry_price REAL,
+    stoploss_price REAL,
+    initial_stoploss REAL,
+    fill_price REAL,
+    fill_time TEXT,
+    sl_order_id TEXT,
+    exit_price REAL,
+    exit_order_id TEXT,
+    exit_time TEXT,
+    exit_reason TEXT,
+    status TEXT NOT NULL,
+    pnl REAL,
+    strategy TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_trades_date ON trades(date);
+CREATE INDEX IF NOT EXISTS idx_trades_symbol ON trades(symbol, date);
+CREATE INDEX IF NOT EXISTS idx_trades_status ON trades(status);
+CREATE INDEX IF NOT EXISTS idx_trades_sl_order ON trades(sl_order_id);
+CREATE TABLE IF NOT EXISTS trade_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_order_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_order ON trade_events(entry_order_id);
+"""
+
+# group name -> SQL expression
+GROUPS = {
+    "symbol": "symbol",
+    "hour": "hour",
+    "exit_reason": "exit_reason",
+    "date": "date",
+    "action": "action",
+    "strategy": "strategy"
+}
+
+# Exits whose price never came back (exit_price 0) have NULL pnl; they are
+# counted as "unpriced" and kept out of trades / win rate / SL hit rate.
+STATS_SQL = """
+                   COUNT(pnl) AS trades,
+                   SUM(pnl IS NULL) AS unpriced,
+                   ROUND(SUM(pnl), 2) AS pnl,
+                   ROUND(AVG(pnl), 2) AS avg_pnl,
+                   SUM(pnl > 0) AS wins,
+                   SUM(CASE WHEN pnl IS NOT NULL THEN exit_reason = 'sl' END) AS sl_hits,
+                   ROUND(AVG({slippage}), 4) AS avg_slippage"""
+
+# Signed slippage: positive means the fill was worse than the alert price
+SLIPPAGE_SQL = "CASE WHEN action = 'buy' THEN fill_price - entry_price ELSE entry_price - fill_price END"
+
+
+class TradeStore:
+    """
+    Local SQLite warehouse of every trade lifecycle event.
+
+    One row per entry order in `trades` (kept current as the trade moves
+    through pending -> filled -> exited/cancelled) plus an append-only
+    `trade_events` log. Date and hour bucket are stored as columns so the
+    aggregate queries run off indexes instead of parsing timestamps.
+
+    The connection is opened on first use, and every read and write goes
+    through `self.lock` since it is shared by the Flask, monitor, trailing
+    and reconciler threads.
+    """
+
+    def __init__(self, path=TRADES_DB_FILE):
+        self.path = path
+        self._conn = None
+        self.lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            # Databases created before per-strategy exits lack the column
+            if "strategy" not in {r["name"] for r in conn.execute("PRAGMA table_info(trades)")}:
+                conn.execute("ALTER TABLE trades ADD COLUMN strategy TEXT")
+            self._conn = conn
+        return self._conn
+
+    def _read(self, sql, params=()):
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
+
+    def _write(self, entry_order_id, event, sql, params, data=None):
+        now = datetime.now(IST).isoformat()
+        try:
+            with self.lock, self.conn:
+                self.conn.execute(sql, params)
+                self.conn.execute(
+                    "INSERT INTO trade_events (entry_order_id, event, ts, data) VALUES (?, ?, ?, ?)",
+                    (str(entry_order_id), event, now, json.dumps(data, default=str) if data else None)
+                )
+        except Exception as e:
+            print(f"[trades_db {event} error] {e}")
+
+    # --- Lifecycle events ---
+    def record_entry(self, entry_order_id, symbol, action, entry_price, stoploss_price, strategy="default"):
+        now = datetime.now(IST)
+        self._write(entry_order_id, "entry", """
+            INSERT OR REPLACE INTO trades
+                (entry_order_id, date, hour, symbol, action, entry_price, stoploss_price, initial_stoploss, status, strategy)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)
+        """, (str(entry_order_id), now.strftime("%Y-%m-%d"), now.hour, symbol, action,
+              entry_price, stoploss_price, stoploss_price, strategy))
+
+    def record_fill(self, entry_order_id, fill_price, fill_time, sl_order_id):
+        self._write(entry_order_id, "fill", """
+            UPDATE trades SET fill_price = ?, fill_time = ?, sl_order_id = ?, status = 'sl_placed'
+            WHERE entry_order_id = ?
+        """, (fill_price, fill_time.isoformat(), str(sl_order_id), str(entry_order_id)))
+
+    def record_sl_modified(self, entry_order_id, new_sl):
+        self._write(entry_order_id, "sl_modified", """
+            UPDATE trades SET stoploss_price = ? WHERE entry_order_id = ?
+        """, (new_sl, str(entry_order_id)), {"stoploss_price": new_sl})
+
+    def record_exit(self, entry_order_id, exit_price, exit_order_id, reason):
+        self._write(entry_order_id, "exit", """
+            UPDATE trades SET exit_price = ?, exit_order_id = ?, exit_time = ?, exit_reason = ?, status = 'exited',
+                pnl = CASE WHEN ? > 0 AND fill_price > 0 THEN
+                    CASE WHEN action = 'buy' THEN ? - fill_price ELSE fill_price - ? END
+                END
+            WHERE entry_order_id = ?
+        """, (exit_price, str(exit_order_id), datetime.now(IST).isoformat(), reason,
+              exit_price, exit_price, exit_price, str(entry_order_id)),
+            {"exit_price": exit_price, "reason": reason})
+
+    def record_cancel(self, entry_order_id, reason="stale"):
+        self._write(entry_order_id, "cancel", """
+            UPDATE trades SET status = 'cancelled', exit_reason = ? WHERE entry_order_id = ?
+        """, (reason, str(entry_order_id)))
+
+    # --- Queries ---
+    def trade(self, entry_order_id):
+        rows = self._read("SELECT * FROM trades WHERE entry_order_id = ?", (str(entry_order_id),))
+        return rows[0] if rows else None
+
+    def initial_stoploss(self, entry_order_id):
+        row = self.trade(entry_order_id)
+        return row["initial_stoploss"] if row else None
+
+    def status(self, entry_order_id):
+        row = self.trade(entry_order_id)
+        return row["status"] if row else None
+
+    def _where(self, since=None, until=None, symbol=None):
+        clauses, params = [], []
+        if since:
+            clauses.append("date >= ?")
+            params.append(since)
+        if until:
+            clauses.append("date <= ?")
+            params.append(until)
+        if symbol:
+            clauses.append("symbol = ?")
+            params.append(symbol)
+        return (" AND " + " AND ".join(clauses)) if clauses else "", params
+
+    def pnl_by(self, group="symbol", since=None, until=None, symbol=None):
+        if group not in GROUPS:
+            raise ValueError(f"Unknown group '{group}', expected one of {sorted(GROUPS)}")
+        where, params = self._where(since, until, symbol)
+        return self._read(f"""
+            SELECT {GROUPS[group]} AS bucket,{STATS_SQL.format(slippage=SLIPPAGE_SQL)}
+            FROM trades
+            WHERE status = 'exited'{where}
+            GROUP BY bucket
+            ORDER BY bucket
+        """, params)
+
+    def summary(self, since=None, until=None, symbol=None):
+        where, params = self._where(since, until, symbol)
+        result = self._read(f"""
+            SELECT{STATS_SQL.format(slippage=SLIPPAGE_SQL)}
+            FROM trades
+            WHERE status = 'exited'{where}
+        """, params)[0]
+        trades = result["trades"] or 0
+        result["win_rate"] = round((result["wins"] or 0) / trades, 4) if trades else 0
+        result["sl_hit_rate"] = round((result["sl_hits"] or 0) / trades, 4) if trades else 0
+        return result
+
+    def export_summary_to_sheet(self, worksheet, group="date", since=None, until=None):
+        rows = self.pnl_by(group, since, until)
+        header = [group, "trades", "unpriced", "pnl", "avg_pnl", "wins", "sl_hits", "avg_slippage"]
+        values = [header] + [[r["bucket"], r["trades"], r["unpriced"], r["pnl"], r["avg_pnl"], r["wins"],
+                              r["sl_hits"], r["avg_slippage"]] for r in rows]
+        worksheet.clear()
+        worksheet.update("A1", values)
+        return len(rows)
+
+
+def _open_summary_worksheet(title="Summary"):
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+    scope = ["Confidential"]
+    creds = ServiceAccountCredentials.from_json_keyfile_name("gcreds.json", scope)
+    book = gspread.authorize(creds).open("Trade Alerts DB")
+    try:
+        return book.worksheet(title)
+    except gspread.exceptions.WorksheetNotFound:
+        return book.add_worksheet(title=title, rows=1000, cols=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the local trade warehouse")
+    parser.add_argument("command", choices=["summary", "pnl", "export"])
+    parser.add_argument("--by", default="symbol", choices=sorted(GROUPS))
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    parser.add_argument("--until", help="YYYY-MM-DD")
+    parser.add_argument("--symbol")
+    parser.add_argument("--db", default=TRADES_DB_FILE)
+    args = parser.parse_args()
+
+    store = TradeStore(args.db)
+    if args.command == "summary":
+        print(json.dumps(store.summary(args.since, args.until, args.symbol), indent=2))
+    elif args.command == "pnl":
+        for row in store.pnl_by(args.by, args.since, args.until, args.symbol):
+            print(json.dumps(row))
+    else:
+        count = store.export_summary_to_sheet(_open_summary_worksheet(), args.by, args.since, args.until)
+        print(f"Exported {count} {args.by} rows to Summary sheet")
+
+
+# Lazy: nothing is created on disk until the bot first records or queries a trade
+trade_store = TradeStore()
+
+if __name__ == "__main__":
+    main()
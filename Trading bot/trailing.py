@@ -0,0 +1,252 @@
+# File: trailing.py
+
+import json
+import threading
+import time
+import numpy as np
+from alerts import send_telegram_alert
+from login import login_manager
+from trades_db import trade_store
+
+# Defaults used when config.json has no "trailing" section.
+# All distances are expressed in R (the initial entry-to-stoploss risk).
+TRAILING_DEFAULTS = {
+    "enabled": True,
+    "breakeven_r": 1.0,        # move SL to entry once price is 1R in favour
+    "trail_start_r": 1.5,      # start trailing once price is 1.5R in favour
+    "trail_distance_r": 1.0,   # keep SL 1R behind the last price while trailing
+    "eval_interval": 1.0,      # seconds between rule evaluations
+    "max_modify_per_sec": 5,   # broker modify_order rate limit
+    "quote_max_age": 60,       # seconds; older quotes are not trailed on
+    "tick_size": 0.1
+}
+
+def load_trailing_config():
+    config = dict(TRAILING_DEFAULTS)
+    try:
+        with open("config.json") as f:
+            config.update(json.load(f).get("trailing", {}))
+    except Exception as e:
+        print(f"[trailing config] using defaults: {e}")
+    return config
+
+
+class QuoteCache:
+    """
+    Last traded price per symbol, fed by the Shoonya websocket touchline.
+
+    The socket is tied to a login session: `sync` starts it once per session
+    token (NorenApi reconnects on its own after that), and closes it and
+    drops every cached price on logout or re-login.
+    """
+
+    def __init__(self, max_age=60):
+        self.prices = {}           # clean symbol -> (last price, monotonic time)
+        self.token_to_symbol = {}  # NSE token -> clean symbol
+        self.symbol_to_token = {}
+        self.max_age = max_age
+        self.session = None        # session token the socket was started with
+        self.open = False
+        self.lock = threading.Lock()
+
+    def _on_open(self):
+        self.open = True
+        with self.lock:
+            tokens = [f"NSE|{t}" for t in self.token_to_symbol]
+        if tokens:
+            # The "tk" ack carries the current lp, so prices refill right away
+            login_manager.get_api().subscribe(tokens)
+
+    def _on_close(self):
+        self.open = False
+        self.prices.clear()
+
+    def _on_tick(self, tick):
+        # "tk" is the subscription ack, "tf" the feed; "lp" is only sent when it changes
+        lp = tick.get("lp")
+        symbol = self.token_to_symbol.get(tick.get("tk"))
+        if lp is not None and symbol:
+            self.prices[symbol] = (float(lp), time.monotonic())
+
+    def _stop(self):
+        try:
+            login_manager.get_api().close_websocket()
+        except Exception as e:
+            print(f"[quote cache] websocket close failed: {e}")
+        self.session = None
+        self.open = False
+        self.prices.clear()
+
+    def sync(self):
+        session = login_manager.session_data.get("susertoken") if login_manager.is_logged_in() else None
+        if session == self.session:
+            return
+        if self.session is not None:
+            self._stop()
+        if session is None:
+            return
+        try:
+            login_manager.get_api().start_websocket(
+                subscribe_callback=self._on_tick,
+                socket_open_callback=self._on_open,
+                socket_close_callback=self._on_close
+            )
+            self.session = session
+        except Exception as e:
+            print(f"[quote cache] websocket start failed: {e}")
+
+    def _lookup_token(self, symbol):
+        raw_symbol = f"{symbol}-EQ" if not symbol.endswith("-EQ") else symbol
+        ret = login_manager.get_api().searchscrip(exchange="NSE", searchtext=raw_symbol)
+        for value in (ret or {}).get("values", []):
+            if value.get("tsym") == raw_symbol:
+                return value.get("token")
+        return None
+
+    def watch(self, symbol):
+        with self.lock:
+            if symbol in self.symbol_to_token:
+                return
+            try:
+                token = self._lookup_token(symbol)
+            except Exception as e:
+                print(f"[quote cache] token lookup failed for {symbol}: {e}")
+                return
+            if not token:
+                return
+            self.symbol_to_token[symbol] = token
+            self.token_to_symbol[token] = symbol
+        if self.open:
+            login_manager.get_api().subscribe([f"NSE|{token}"])
+
+    def get(self, symbol):
+        quote = self.prices.get(symbol)
+        if not quote or time.monotonic() - quote[1] > self.max_age:
+            return None
+        return quote[0]
+
+
+class TrailingEngine:
+    """
+    Trails / breakevens the SL-LMT of every open position.
+
+    Rules are evaluated for all positions at once with numpy; only positions
+    whose tick-rounded SL actually changes are queued for modify_order. The
+    queue is keyed by SL order ID so a burst of ticks collapses into one
+    modification per order, and it is drained under a rate limit.
+    """
+
+    def __init__(self, positions, symbol_mapper, quotes):
+        self.positions = positions
+        self.symbol_mapper = symbol_mapper
+        self.quotes = quotes
+        self.config = load_trailing_config()
+        quotes.max_age = self.config["quote_max_age"]
+        self.pending = {}  # sl_order_id -> (pid, new_sl)
+        self.pending_lock = threading.Lock()
+
+    def evaluate(self):
+        pids, pos_list, lps = [], [], []
+        for pid, pos in list(self.positions.items()):
+            lp = self.quotes.get(pos["symbol"])
+            if lp is None:
+                self.quotes.watch(pos["symbol"])
+                continue
+            pids.append(pid)
+            pos_list.append(pos)
+            lps.append(lp)
+        if not pids:
+            return 0
+
+        n = len(pos_list)
+        lp = np.array(lps, dtype=float)
+        entry = np.fromiter((p["entry_price"] for p in pos_list), float, n)
+        current = np.fromiter((p["stoploss_price"] for p in pos_list), float, n)
+        initial = np.fromiter((p.get("initial_stoploss", p["stoploss_price"]) for p in pos_list), float, n)
+        side = np.fromiter((1.0 if p["action"] == "buy" else -1.0 for p in pos_list), float, n)
+
+        cfg = self.config
+        tick = cfg["tick_size"]
+        risk = np.abs(entry - initial)
+        move = side * (lp - entry)
+
+        # Work in "favourable" space (side * price) so buy and sell share one max()
+        fav_current = side * current
+        fav_be = np.where(move >= cfg["breakeven_r"] * risk, side * entry, fav_current)
+        fav_trail = np.where(move >= cfg["trail_start_r"] * risk,
+                             side * lp - cfg["trail_distance_r"] * risk, fav_current)
+        fav_new = np.maximum(fav_current, np.maximum(fav_be, fav_trail))
+
+        new_sl = np.round(np.round(side * fav_new / tick) * tick, 2)
+        # Never move a stop through the market, and ignore positions with no risk
+        valid = (risk > 0) & (side * new_sl < side * lp)
+        changed = valid & (np.abs(new_sl - current) >= tick / 2)
+
+        with self.pending_lock:
+            for i in np.flatnonzero(changed):
+                pos = pos_list[i]
+                self.pending[pos["sl_order_id"]] = (pids[i], float(new_sl[i]))
+        return int(changed.sum())
+
+    def _modify(self, pid, sl_order_id, new_sl):
+        pos = self.positions.get(pid)
+        if not pos or pos["sl_order_id"] != sl_order_id:
+            return  # position exited while queued
+        try:
+            if not login_manager.is_logged_in():
+                login_manager.login()
+            api = login_manager.get_api()
+            ret = api.modify_order(
+                orderno=sl_order_id,
+                exchange="NSE",
+                tradingsymbol=self.symbol_mapper.prepare_for_api(pos["symbol"]),
+                newquantity="1",
+                newprice_type="SL-LMT",
+                newprice=str(new_sl),
+                newtrigger_price=str(new_sl)
+            )
+            if ret and ret.get("stat") == "Ok":
+                pos.setdefault("initial_stoploss", pos["stoploss_price"])
+                old_sl = pos["stoploss_price"]
+                pos["stoploss_price"] = new_sl
+                trade_store.record_sl_modified(pos["entry_order_id"], new_sl)
+                send_telegram_alert(f"🪜 SL Trailed: {pos['symbol']} ₹{old_sl} → ₹{new_sl} | SL Order ID: {sl_order_id}")
+            else:
+                print(f"[trailing] modify failed for {sl_order_id}: {ret}")
+        except Exception as e:
+            print(f"[trailing] modify error for {sl_order_id}: {e}")
+
+    def drain(self):
+        with self.pending_lock:
+            batch, self.pending = self.pending, {}
+        interval = 1.0 / max(self.config["max_modify_per_sec"], 1)
+        for sl_order_id, (pid, new_sl) in batch.items():
+            started = time.monotonic()
+            self._modify(pid, sl_order_id, new_sl)
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def evaluate_loop(self):
+        while True:
+            try:
+                self.quotes.sync()
+                self.evaluate()
+            except Exception as e:
+                print(f"[trailing evaluate error] {e}")
+            time.sleep(self.config["eval_interval"])
+
+    def modify_loop(self):
+        while True:
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"[trailing modify error] {e}")
+            time.sleep(self.config["eval_interval"])
+
+    def start(self):
+        if not self.config["enabled"]:
+            return
+        threading.Thread(target=self.evaluate_loop, daemon=True).start()
+        threading.Thread(target=self.modify_loop, daemon=True).start()
+
+
+quote_cache = QuoteCache()